@@ -1,20 +1,54 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from typing import Dict, Any, List, Optional
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query
+from typing import Dict, Any, Optional
 import uuid
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
 
 from app.models.deployment import DeploymentRequest, DeploymentResponse
 from app.services.deployment_service import deploy_model
-from app.db.firebase import db
+from app.db.firebase import get_async_db
+from app.db.cache import clear_progress, get_deployment_cached, invalidate
 
 router = APIRouter()
 logger = logging.getLogger("api-endpoints")
 
+# Upper bound on the page size for list_deployments
+_MAX_LIST_LIMIT = 500
+
+# Page cursors are "<createdAt as epoch microseconds>_<document ID>", which
+# survive being put in a query string without encoding. The ID breaks ties
+# between deployments created in the same microsecond.
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Fields read by get_deployment_status; skips large blobs such as
+# containerDetails and localEndpoints
+_STATUS_FIELDS = [
+    'status', 'modelId', 'createdAt', 'containerId', 'machineId', 'tunnelUrl', 'endpoints',
+    'error', 'failedAt', 'deploymentCompleted', 'deploymentDuration'
+]
+
+# Progress percentage and estimated time remaining for each deployment status
+_PROGRESS = {
+    'queued': 5,
+    'deploying': 15,
+    'starting': 50,
+    'active': 100,
+    'failed': -1,  # Error state
+}
+_ETA = {
+    'queued': "5-10 minutes",
+    'deploying': "4-8 minutes",
+    'starting': "1-3 minutes",
+}
+
 @router.post("/deploy", response_model=DeploymentResponse)
 async def deploy(request: DeploymentRequest, background_tasks: BackgroundTasks):
     try:
-        deployment_id = str(uuid.uuid4())
+        deployment_id = uuid.uuid4().hex
+        created_at = datetime.now().isoformat()
         
         deployment_data = {
             'deploymentId': deployment_id,
@@ -22,13 +56,11 @@ async def deploy(request: DeploymentRequest, background_tasks: BackgroundTasks):
             'modelId': request.model_id,
             'apiName': request.api_name,
             'status': 'queued',
-            'createdAt': datetime.now().isoformat()
+            'createdAt': firestore.SERVER_TIMESTAMP
         }
         
-        if db:
-            from firebase_admin import firestore
-            deployment_data['createdAt'] = firestore.SERVER_TIMESTAMP
-            db.collection('deployments').document(deployment_id).set(deployment_data)
+        if (async_db := get_async_db()):
+            await async_db.collection('deployments').document(deployment_id).set(deployment_data)
         
         background_tasks.add_task(deploy_model, deployment_id, request)
         
@@ -37,7 +69,7 @@ async def deploy(request: DeploymentRequest, background_tasks: BackgroundTasks):
         return DeploymentResponse(
             deployment_id=deployment_id,
             status="queued",
-            created_at=datetime.now().isoformat(),
+            created_at=created_at,
             monitor_url=monitor_url
         )
         
@@ -50,51 +82,33 @@ async def get_deployment(deployment_id: str):
     """
     Get raw deployment data
     """
-    if not db:
+    async_db = get_async_db()
+    if not async_db:
         raise HTTPException(status_code=500, detail="Firebase not configured")
     
-    doc = db.collection('deployments').document(deployment_id).get()
-    if not doc.exists:
+    deployment_data = await get_deployment_cached(deployment_id)
+    if deployment_data is None:
         raise HTTPException(status_code=404, detail="Deployment not found")
     
-    return doc.to_dict()
+    return deployment_data
 
 @router.get("/deployments/{deployment_id}/status", response_model=Dict[str, Any])
 async def get_deployment_status(deployment_id: str):
     """
     Get detailed deployment status with progress information
     """
-    if not db:
+    async_db = get_async_db()
+    if not async_db:
         raise HTTPException(status_code=500, detail="Firebase not configured")
     
-    doc = db.collection('deployments').document(deployment_id).get()
-    if not doc.exists:
+    deployment_data = await get_deployment_cached(deployment_id, field_paths=_STATUS_FIELDS)
+    if deployment_data is None:
         raise HTTPException(status_code=404, detail="Deployment not found")
     
-    deployment_data = doc.to_dict()
     status = deployment_data.get('status', 'unknown')
     
-    # Calculate progress percentage based on status
-    progress = 0
-    if status == 'queued':
-        progress = 5
-    elif status == 'deploying':
-        progress = 15
-    elif status == 'starting':
-        progress = 50
-    elif status == 'active':
-        progress = 100
-    elif status == 'failed':
-        progress = -1  # Error state
-    
-    # Determine estimated time remaining
-    estimated_time = None
-    if status == 'queued':
-        estimated_time = "5-10 minutes"
-    elif status == 'deploying':
-        estimated_time = "4-8 minutes"
-    elif status == 'starting':
-        estimated_time = "1-3 minutes"
+    progress = _PROGRESS.get(status, 0)
+    estimated_time = _ETA.get(status)
     
     # Prepare the detailed status response
     response = {
@@ -122,44 +136,83 @@ async def get_deployment_status(deployment_id: str):
     
     return response
 
-@router.get("/deployments", response_model=List[Dict[str, Any]])
-async def list_deployments(user_id: Optional[str] = None, limit: int = 10):
-    if not db:
+@router.get("/deployments", response_model=Dict[str, Any])
+async def list_deployments(user_id: Optional[str] = None,
+                           limit: int = Query(10, ge=1, le=_MAX_LIST_LIMIT),
+                           before: Optional[str] = None):
+    """
+    List deployments newest first. Pass the returned next_page as `before`
+    to fetch the following page.
+    """
+    async_db = get_async_db()
+    if not async_db:
         raise HTTPException(status_code=500, detail="Firebase not configured")
     
-    query = db.collection('deployments')
+    query = async_db.collection('deployments')
     if user_id:
         query = query.where('userId', '==', user_id)
     
-    query = query.order_by('createdAt', direction='DESCENDING').limit(limit)
-    deployments = [doc.to_dict() for doc in query.stream()]
+    # Only fetch the fields the list view renders, not endpoints/containerDetails blobs
+    query = query.select(['deploymentId', 'userId', 'modelId', 'apiName', 'status', 'createdAt', 'tunnelUrl'])
+    query = query.order_by('createdAt', direction='DESCENDING')
+    query = query.order_by('__name__', direction='DESCENDING')
+    
+    if before:
+        micros, _, last_id = before.partition("_")
+        try:
+            cursor = _EPOCH + int(micros) * _MICROSECOND
+        except (ValueError, OverflowError):
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {before}")
+        if not last_id:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {before}")
+        query = query.start_after({
+            'createdAt': cursor,
+            '__name__': async_db.collection('deployments').document(last_id)
+        })
+    
+    query = query.limit(limit)
+    docs = [doc async for doc in query.stream()]
+    deployments = [doc.to_dict() for doc in docs]
     
-    return deployments
+    # Only hand out a cursor when the page is full, otherwise there is nothing after it
+    next_page = None
+    if len(docs) == limit and deployments[-1].get('createdAt'):
+        micros = (deployments[-1]['createdAt'] - _EPOCH) // _MICROSECOND
+        next_page = f"{micros}_{docs[-1].id}"
+    
+    return {
+        'deployments': deployments,
+        'total': len(deployments),
+        'limit': limit,
+        'next_page': next_page
+    }
 
 @router.delete("/deployments/{deployment_id}", response_model=Dict[str, Any])
 async def delete_deployment(deployment_id: str):
     """
     Delete a deployment - stops the container and removes the deployment
     """
-    if not db:
+    async_db = get_async_db()
+    if not async_db:
         raise HTTPException(status_code=500, detail="Firebase not configured")
     
     # Get deployment info
-    doc = db.collection('deployments').document(deployment_id).get()
-    if not doc.exists:
+    deployment_data = await get_deployment_cached(deployment_id)
+    if deployment_data is None:
         raise HTTPException(status_code=404, detail="Deployment not found")
     
-    deployment_data = doc.to_dict()
     
     # If the deployment has an active container, we should stop it
     # This would require implementing container stopping logic in a service
     # For now, we'll just mark it as deleted in the database
     
-    from firebase_admin import firestore
-    db.collection('deployments').document(deployment_id).update({
+    await async_db.collection('deployments').document(deployment_id).update({
         'status': 'deleted',
         'deletedAt': firestore.SERVER_TIMESTAMP
     })
+    # Drop any in-process progress too, or reads would keep overlaying it on the new status
+    invalidate(deployment_id)
+    clear_progress(deployment_id)
     
     return {
         'deployment_id': deployment_id,
@@ -172,15 +225,15 @@ async def stop_deployment(deployment_id: str):
     """
     Stop a running deployment without deleting it
     """
-    if not db:
+    async_db = get_async_db()
+    if not async_db:
         raise HTTPException(status_code=500, detail="Firebase not configured")
     
     # Get deployment info
-    doc = db.collection('deployments').document(deployment_id).get()
-    if not doc.exists:
+    deployment_data = await get_deployment_cached(deployment_id)
+    if deployment_data is None:
         raise HTTPException(status_code=404, detail="Deployment not found")
     
-    deployment_data = doc.to_dict()
     current_status = deployment_data.get('status')
     
     if current_status != 'active':
@@ -190,11 +243,12 @@ async def stop_deployment(deployment_id: str):
         )
     
     # Update status to stopped
-    from firebase_admin import firestore
-    db.collection('deployments').document(deployment_id).update({
+    await async_db.collection('deployments').document(deployment_id).update({
         'status': 'stopped',
         'stoppedAt': firestore.SERVER_TIMESTAMP
     })
+    invalidate(deployment_id)
+    clear_progress(deployment_id)
     
     return {
         'deployment_id': deployment_id,
@@ -1,9 +1,39 @@
+import functools
 import os
+from pathlib import Path
 from typing import List
 from pydantic_settings import BaseSettings
-from dotenv import load_dotenv
 
-load_dotenv()
+ENV_FILE = Path(__file__).resolve().parents[2] / ".env"
+
+@functools.lru_cache(maxsize=None)
+def load_env_file(path: Path = ENV_FILE):
+    """
+    Read KEY=VALUE lines from the .env file into os.environ, once per process.
+    Variables already set in the environment take precedence.
+    """
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
+        return
+    
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        
+        key, value = line.split("=", 1)
+        key = key.strip()
+        if key.startswith("export "):
+            key = key[len("export "):].strip()
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+            value = value[1:-1]
+        else:
+            value = value.split(" #", 1)[0].rstrip()
+        os.environ.setdefault(key, value)
+
+load_env_file()
 
 class Settings(BaseSettings):
     API_PORT: int = int(os.getenv("API_PORT", 8000))
@@ -11,6 +41,11 @@ class Settings(BaseSettings):
     FIREBASE_CREDENTIALS_PATH: str = os.getenv("FIREBASE_CREDENTIALS_PATH", "firebase-credentials.json")
     DEFAULT_HOST_PORT: int = int(os.getenv("DEFAULT_HOST_PORT", 2242))
     HUGGINGFACE_TOKEN: str = os.getenv("HUGGINGFACE_TOKEN", "")
+    MAX_CONCURRENT_DEPLOYMENTS: int = int(os.getenv("MAX_CONCURRENT_DEPLOYMENTS", 4))
+    # Tunnel setups already run one per deploy pool thread, so this only has an
+    # effect when set below MAX_CONCURRENT_DEPLOYMENTS
+    TUNNEL_MAX_CONCURRENCY: int = int(os.getenv("TUNNEL_MAX_CONCURRENCY", MAX_CONCURRENT_DEPLOYMENTS))
+    APHRODITE_REF: str = os.getenv("APHRODITE_REF", "main")
     CORS_ORIGINS: List[str] = ["*"]
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,83 @@
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+from firebase_admin import firestore
+
+from app.db.firebase import get_async_db
+
+logger = logging.getLogger("firebase-cache")
+
+# Short-lived cache of deployment documents keyed by deployment_id.
+# Stores plain dicts (doc.to_dict()) rather than DocumentSnapshot objects.
+doc_cache = TTLCache(maxsize=10000, ttl=5)
+
+# Same, for reads restricted to a field mask, one cache per distinct mask
+_projection_caches: Dict[Tuple[str, ...], TTLCache] = {}
+
+# Progress of deployments running in this process that has not been written
+# to Firestore yet (only terminal states are persisted). Overlaid on reads.
+# It does not survive the process: after a crash mid-deploy the document stays
+# at its initial status with no hostPort or containerId, so an orphaned
+# container has to be found on the host (compose project aphrodite-<id>).
+live_progress: Dict[str, Dict[str, Any]] = {}
+
+def _cache_for(field_paths: Optional[List[str]]) -> TTLCache:
+    if not field_paths:
+        return doc_cache
+
+    key = tuple(field_paths)
+    cache = _projection_caches.get(key)
+    if cache is None:
+        cache = _projection_caches[key] = TTLCache(maxsize=10000, ttl=5)
+    return cache
+
+async def get_deployment_cached(deployment_id: str,
+                                field_paths: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Return the deployment document as a dict, or None if it does not exist.
+    Pass field_paths to fetch only those fields from Firestore.
+    """
+    cache = _cache_for(field_paths)
+    deployment_data = cache.get(deployment_id)
+    if deployment_data is None:
+        doc_ref = get_async_db().collection('deployments').document(deployment_id)
+        doc = await doc_ref.get(field_paths=field_paths)
+        if not doc.exists:
+            return None
+
+        deployment_data = doc.to_dict()
+        cache[deployment_id] = deployment_data
+
+    progress = live_progress.get(deployment_id)
+    if progress:
+        return {**deployment_data, **progress}
+    return deployment_data
+
+def invalidate(deployment_id: str):
+    """
+    Drop a deployment from the cache after it has been written
+    """
+    doc_cache.pop(deployment_id, None)
+    for cache in _projection_caches.values():
+        cache.pop(deployment_id, None)
+
+def record_progress(deployment_id: str, fields: Dict[str, Any]):
+    """
+    Record in-process progress for a running deployment.
+    Server-side sentinels (SERVER_TIMESTAMP) only have meaning in Firestore, so
+    the overlay gets the local time instead until the write lands.
+    """
+    now = datetime.now(timezone.utc)
+    progress = live_progress.setdefault(deployment_id, {})
+    progress.update(
+        (key, now if value is firestore.SERVER_TIMESTAMP else value)
+        for key, value in fields.items()
+    )
+
+def clear_progress(deployment_id: str):
+    """
+    Forget in-process progress once the deployment's terminal state is in Firestore
+    """
+    live_progress.pop(deployment_id, None)
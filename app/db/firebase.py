@@ -1,23 +1,20 @@
+import functools
 import logging
 import os
 
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
 
 from app.core.config import settings
 
 logger = logging.getLogger("firebase")
 
-_firebase_app = None
-_firestore_client = None
-
+@functools.lru_cache(maxsize=1)
 def initialize_firebase():
-    global _firebase_app, _firestore_client
-    
-    # If already initialized, return existing client
-    if _firestore_client is not None:
-        return _firestore_client
-
+    """
+    Initialize the Firebase app and Firestore client on first use.
+    The result is cached, so credentials are only loaded once per process.
+    """
     try:
         cred_path = settings.FIREBASE_CREDENTIALS_PATH
 
@@ -31,15 +28,50 @@ def initialize_firebase():
         except ValueError:
             # No default app exists, so initialize
             cred = credentials.Certificate(cred_path)
-            _firebase_app = firebase_admin.initialize_app(cred)
+            firebase_admin.initialize_app(cred)
 
-        _firestore_client = firestore.client()
+        firestore_client = firestore.client()
         logger.info("Firebase initialized successfully")
-        return _firestore_client
+        return firestore_client
 
     except Exception as e:
         logger.error(f"Failed to initialize Firebase: {str(e)}")
         return None
 
-# Initialize only once when the module is first imported
-db = initialize_firebase()
\ No newline at end of file
+@functools.lru_cache(maxsize=1)
+def initialize_firebase_async():
+    """
+    Create the async Firestore client so request handlers can await reads and
+    writes instead of blocking the event loop
+    """
+    # The async client shares the default app set up by initialize_firebase
+    if initialize_firebase() is None:
+        return None
+
+    try:
+        firestore_async_client = firestore_async.client()
+        logger.info("Async Firestore client initialized successfully")
+        return firestore_async_client
+
+    except Exception as e:
+        logger.error(f"Failed to initialize async Firestore client: {str(e)}")
+        return None
+
+def get_db():
+    return initialize_firebase()
+
+def get_async_db():
+    return initialize_firebase_async()
+
+async def get_many(deployment_ids):
+    """
+    Fetch several deployment documents in one batched get_all RPC.
+    Use this instead of per-document get() calls when reading many deployments,
+    e.g. from the monitor service.
+    """
+    async_db = get_async_db()
+    if async_db is None:
+        return []
+
+    refs = [async_db.collection('deployments').document(deployment_id) for deployment_id in deployment_ids]
+    return [doc async for doc in async_db.get_all(refs)]
\ No newline at end of file
@@ -6,8 +6,9 @@ from contextlib import asynccontextmanager
 
 from app.api.v1.router import api_router
 from app.core.config import settings
-from app.db.firebase import initialize_firebase
-from app.services.monitor_service import start_monitor_scheduler
+from app.services import ssh_pool
+from app.services.deployment_service import drain_pending_commits, shutdown_deploy_pool
+from app.services.monitor_service import close_http_client, start_monitor_scheduler
 
 logging.basicConfig(
     level=logging.INFO,
@@ -15,11 +16,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger("aphrodite-api")
 
-db = initialize_firebase()
-
 # Global variable to store monitor task
 monitor_task = None
 
+async def sweep_ssh_pool(interval_seconds: int = 60):
+    """
+    Close idle SSH connections to hosts that are no longer being deployed to
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        ssh_pool.evict_idle()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
@@ -31,6 +38,7 @@ async def lifespan(app: FastAPI):
     
     # Start monitoring in background
     monitor_task = asyncio.create_task(start_monitor_scheduler(interval_seconds=5))
+    sweep_task = asyncio.create_task(sweep_ssh_pool())
     
     # Yield control back to FastAPI
     yield
@@ -43,6 +51,16 @@ async def lifespan(app: FastAPI):
             await monitor_task
         except asyncio.CancelledError:
             logger.info("Monitor task cancelled successfully")
+    sweep_task.cancel()
+    await close_http_client()
+    
+    # Abandon in-flight deployment steps rather than waiting on them; closing
+    # their SSH clients makes blocked workers fail fast
+    shutdown_deploy_pool()
+    ssh_pool.close_all()
+    
+    # Don't lose deployment results that are still being written
+    await drain_pending_commits()
 
 # Create the FastAPI application with lifespan
 app = FastAPI(
@@ -62,28 +80,6 @@ app.add_middleware(
 
 app.include_router(api_router, prefix="/api")
 
-# If you're using an older version of FastAPI without lifespan support,
-# use these event handlers instead:
-"""
-@app.on_event("startup")
-async def startup_event():
-    global monitor_task
-    logger.info("Starting deployment monitor...")
-    
-    from app.services.monitor_service import start_monitor_scheduler
-    monitor_task = asyncio.create_task(start_monitor_scheduler(interval_seconds=5))
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("Stopping deployment monitor...")
-    if monitor_task:
-        monitor_task.cancel()
-        try:
-            await monitor_task
-        except asyncio.CancelledError:
-            logger.info("Monitor task cancelled successfully")
-"""
-
 @app.get("/")
 async def root():
     return {
@@ -1,210 +1,292 @@
 import asyncio
-import hashlib
 import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, Dict, Set
+from urllib.parse import urlsplit, urlunsplit
 
-import firebase_admin
 from firebase_admin import firestore
+from google.api_core.retry_async import AsyncRetry
 
-from app.db.firebase import db
+from app.core.config import settings
+from app.db.cache import clear_progress, invalidate, record_progress
+from app.db.firebase import get_async_db
 from app.models.deployment import DeploymentRequest
 from app.services.docker_service import (monitor_container_startup,
                                          setup_container)
-from app.services.ssh_service import connect_ssh, ensure_dependencies
+from app.services import ssh_pool
+from app.services.ssh_service import ensure_dependencies, run_command
 from app.services.tunnel_service import (setup_tunnel,
                                          verify_localtunnel_installation)
 
 logger = logging.getLogger("deployment-service")
 
+# Dedicated pool for the blocking SSH/Docker/tunnel steps, sized to the number
+# of deployments we expect to run at once
+_deploy_executor = ThreadPoolExecutor(
+    max_workers=settings.MAX_CONCURRENT_DEPLOYMENTS,
+    thread_name_prefix="deploy"
+)
+
+# Transient Firestore errors are retried with backoff before a commit is given up on
+_COMMIT_RETRY = AsyncRetry(initial=0.1, maximum=2.0, multiplier=2.0, deadline=10.0)
+
+# Terminal-state commits still in flight; held so they are not garbage
+# collected mid-flight and can be drained on shutdown
+_pending_commits: Set[asyncio.Task] = set()
+
+async def _commit_pending(async_db, deployment_id: str, pending: Dict[str, Any]):
+    """
+    Write the buffered deployment fields in one batched commit, retrying transient errors.
+    Final failures are logged, and the in-process state keeps serving the status endpoint.
+    """
+    try:
+        batch = async_db.batch()
+        batch.update(async_db.collection('deployments').document(deployment_id), pending)
+        await batch.commit(retry=_COMMIT_RETRY)
+        invalidate(deployment_id)
+        clear_progress(deployment_id)
+    except Exception as e:
+        logger.error(f"Error committing deployment {deployment_id}: {str(e)}")
+
+def _publish_terminal_state(async_db, deployment_id: str, pending: Dict[str, Any]):
+    """
+    Make the terminal state visible in-process immediately and persist it in the background
+    """
+    record_progress(deployment_id, pending)
+    task = asyncio.create_task(_commit_pending(async_db, deployment_id, dict(pending)))
+    _pending_commits.add(task)
+    task.add_done_callback(_pending_commits.discard)
+
+async def drain_pending_commits():
+    """
+    Wait for in-flight terminal-state commits (called on application shutdown)
+    """
+    if _pending_commits:
+        await asyncio.gather(*_pending_commits, return_exceptions=True)
+
+def shutdown_deploy_pool():
+    """
+    Stop the deploy pool without waiting for running steps (called on application shutdown).
+    Queued steps are cancelled; running ones fail once their SSH clients are closed.
+    """
+    _deploy_executor.shutdown(wait=False, cancel_futures=True)
+
+def _run_in_worker(step, *args):
+    """
+    Run one deployment step coroutine to completion on a deploy pool thread.
+    Uses a selector loop explicitly: channel reads wait with add_reader, which
+    Windows' default proactor loop does not implement.
+    """
+    loop = asyncio.SelectorEventLoop()
+    try:
+        return loop.run_until_complete(step(*args))
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+async def _provision_container(state: Dict[str, Any], deployment_id: str,
+                               request: DeploymentRequest, host_port: int):
+    """
+    Install dependencies and launch the container.
+    Results are recorded in state so the caller can report partial progress on failure.
+    """
+    ssh_client = state['ssh_client']
+    
+    # Get machine ID
+    stdin, stdout, stderr = run_command(ssh_client, "cat /etc/machine-id || hostname")
+    state['machine_id'] = stdout.read().decode('utf-8').strip()
+    logger.info(f"Machine ID: {state['machine_id']}")
+    
+    # Ensure dependencies (Node.js, localtunnel)
+    await ensure_dependencies(ssh_client, request.ssh_config.password)
+    
+    # Setup container with deployment_id for unique naming
+    state['container_id'] = await setup_container(
+        ssh_client=ssh_client,
+        model_id=request.model_id,
+        user_id=request.user_id,
+        host_port=host_port,
+        huggingface_token=request.huggingface_token,
+        deployment_id=deployment_id  # Pass deployment_id for unique container naming
+    )
+
+async def _expose_container(state: Dict[str, Any], deployment_id: str,
+                            request: DeploymentRequest, host_port: int):
+    """
+    Wait for the container to start and open a tunnel to it.
+    Returns the local endpoints and the tunnel URL (None if the tunnel failed).
+    """
+    ssh_client = state['ssh_client']
+    
+    # Monitor container startup with dynamic port handling
+    endpoints = await monitor_container_startup(
+        ssh_client, 
+        state['container_id'], 
+        host_port
+    )
+    
+    # Verify localtunnel installation
+    lt_installed = await verify_localtunnel_installation(
+        ssh_client, 
+        request.ssh_config.password
+    )
+    
+    # Setup tunnel with improved error handling
+    safe_api_name = request.api_name.lower().replace(" ", "-")
+    subdomain = f"{safe_api_name}-{deployment_id[:8]}"  # Using part of deployment_id for uniqueness
+    tunnel_url = await setup_tunnel(
+        ssh_client, 
+        host_port, 
+        subdomain, 
+        request.ssh_config.password
+    )
+    
+    return endpoints, tunnel_url
+
 async def deploy_model(deployment_id: str, request: DeploymentRequest):
     """
     Background task to deploy the model with proper error handling and state management
     """
     start_time = datetime.now()
+    async_db = get_async_db()
     
-    # Generate a unique port for this deployment
-    hash_object = hashlib.md5(deployment_id.encode())
-    hash_int = int(hash_object.hexdigest(), 16)
-    unique_port = 2242 + (hash_int % 60000)  # Range: 2242-62242 (avoiding system reserved ports)
+    # Generate a unique port for this deployment from the deployment UUID's random bits
+    unique_port = 2242 + (uuid.UUID(deployment_id).int & 0xFFFF) % 60000  # Range: 2242-62242 (avoiding system reserved ports)
     
     # Use the configured host port from request if available, otherwise use the unique port
     host_port = request.host_port or unique_port
     
+    # Fields for the deployment document, buffered until the terminal state
+    # is committed in a single batched write
+    pending = {
+        'status': 'deploying',
+        'hostPort': host_port
+    }
+    
     try:
         logger.info(f"Starting deployment {deployment_id} for model {request.model_id} on port {host_port}")
         
-        # Update status to in-progress
-        if db:
-            db.collection('deployments').document(deployment_id).update({
-                'status': 'deploying',
-                'hostPort': host_port  # Store the port in the deployment document
-            })
+        # Intermediate progress is only tracked in-process for the status endpoint
+        record_progress(deployment_id, pending)
         
-        # Connect to SSH
-        ssh_client = None
+        # SSH/Docker/tunnel work is blocking, so it runs on the deploy pool
+        loop = asyncio.get_running_loop()
+        state = {}
         try:
-            ssh_client = connect_ssh(
-                hostname=request.ssh_config.host,
-                username=request.ssh_config.username,
-                port=request.ssh_config.port,
-                password=request.ssh_config.password,
-                key_filename=request.ssh_config.key_file
-            )
-            
-            # Get machine ID
-            stdin, stdout, stderr = ssh_client.exec_command("cat /etc/machine-id || hostname")
-            machine_id = stdout.read().decode('utf-8').strip()
-            logger.info(f"Machine ID: {machine_id}")
-            
-            # Update deployment with machine ID
-            if db:
-                db.collection('deployments').document(deployment_id).update({
-                    'machineId': machine_id
-                })
-            
-            # Ensure dependencies (Node.js, localtunnel)
-            await ensure_dependencies(ssh_client, request.ssh_config.password)
-            
-            # Setup container with deployment_id for unique naming
-            container_id = await setup_container(
-                ssh_client=ssh_client,
-                model_id=request.model_id,
-                user_id=request.user_id,
-                host_port=host_port,
-                huggingface_token=request.huggingface_token,
-                deployment_id=deployment_id  # Pass deployment_id for unique container naming
-            )
-            
-            # Update deployment with container ID
-            if db and container_id:
-                db.collection('deployments').document(deployment_id).update({
+            # Reuse an authenticated connection to this host when one is idle
+            async with ssh_pool.acquire(request.ssh_config) as ssh_client:
+                state['ssh_client'] = ssh_client
+                await loop.run_in_executor(
+                    _deploy_executor, _run_in_worker, _provision_container,
+                    state, deployment_id, request, host_port
+                )
+                container_id = state['container_id']
+                machine_id = state['machine_id']
+                
+                pending.update({
                     'containerId': container_id,
+                    'machineId': machine_id,
                     'status': 'starting'
                 })
+                record_progress(deployment_id, pending)
+                
+                endpoints, tunnel_url = await loop.run_in_executor(
+                    _deploy_executor, _run_in_worker, _expose_container,
+                    state, deployment_id, request, host_port
+                )
             
-            # Monitor container startup with dynamic port handling
-            endpoints = await monitor_container_startup(
-                ssh_client, 
-                container_id, 
-                host_port
-            )
-            
-            # Verify localtunnel installation
-            lt_installed = await verify_localtunnel_installation(
-                ssh_client, 
-                request.ssh_config.password
-            )
-            
-            # Setup tunnel with improved error handling
-            safe_api_name = request.api_name.lower().replace(" ", "-")
-            subdomain = f"{safe_api_name}-{deployment_id[:8]}"  # Using part of deployment_id for uniqueness
-            tunnel_url = await setup_tunnel(
-                ssh_client, 
-                host_port, 
-                subdomain, 
-                request.ssh_config.password
-            )
-            
-            # Map local endpoints to tunnel URLs
+            # Map local endpoints onto the tunnel host, keeping each endpoint's path
             mapped_endpoints = {}
-            for key, local_url in endpoints.items():
-                if local_url and local_url.startswith("http://localhost"):
-                    if tunnel_url:
-                        # Extract the port and path from local URL
-                        parts = local_url.split("localhost:")
-                        if len(parts) >= 2:
-                            port_and_path = parts[1]
-                            # Extract path part after port
-                            path_parts = port_and_path.split("/", 1)
-                            if len(path_parts) > 1:
-                                path = path_parts[1]
-                                mapped_endpoints[key] = f"{tunnel_url.rstrip('/')}/{path}"
-                            else:
-                                mapped_endpoints[key] = tunnel_url
-                        else:
-                            mapped_endpoints[key] = tunnel_url
-                    else:
-                        # If tunnel setup failed, use the local URL
-                        mapped_endpoints[key] = local_url
-                else:
-                    mapped_endpoints[key] = local_url
-            
-            # Prepare deployment data update
-            deployment_data = {
-                'userId': request.user_id,
-                'modelId': request.model_id,
-                'apiName': request.api_name,
-                'containerId': container_id,
-                'machineId': machine_id,
-                'containerPort': host_port,  # Now using the unique host port
-                'tunnelUrl': tunnel_url,
-                'localEndpoints': endpoints,
-                'endpoints': mapped_endpoints,
-                'status': 'active',
-            }
+            if tunnel_url:
+                tunnel = urlsplit(tunnel_url)
+                for key, local_url in endpoints.items():
+                    local = urlsplit(local_url)
+                    mapped_endpoints[key] = urlunsplit((tunnel.scheme, tunnel.netloc, local.path, local.query, local.fragment))
+            else:
+                # If tunnel setup failed, use the local URLs
+                mapped_endpoints = dict(endpoints)
             
-            # Update deployment in Firebase
-            if db:
-                deployment_data['updatedAt'] = firestore.SERVER_TIMESTAMP
-                
-                # Ensure we save detailed information about tunnel and endpoints
-                if tunnel_url:
-                    deployment_data['tunnelUrl'] = tunnel_url
-                
-                # Save both local and mapped endpoints for reference
-                deployment_data['localEndpoints'] = endpoints
-                deployment_data['endpoints'] = mapped_endpoints
-                
-                # Save container and model details
-                deployment_data['containerDetails'] = {
-                    'id': container_id,
-                    'model': request.model_id,
-                    'hostPort': host_port,  # Using the unique host port
-                    'containerPort': 2242
-                }
-                
-                # Additional metadata
-                deployment_data['deploymentCompleted'] = firestore.SERVER_TIMESTAMP
-                deployment_data['deploymentDuration'] = (datetime.now() - start_time).total_seconds()
-                
-                # Update the document
-                db.collection('deployments').document(deployment_id).update(deployment_data)
-                logger.info(f"Updated deployment {deployment_id} with complete details including tunnel URL: {tunnel_url}")
+            # Update deployment in Firebase with the full terminal state
+            if async_db:
+                pending.update({
+                    'userId': request.user_id,
+                    'modelId': request.model_id,
+                    'apiName': request.api_name,
+                    'containerPort': host_port,  # Now using the unique host port
+                    'tunnelUrl': tunnel_url,
+                    # Save both local and mapped endpoints for reference
+                    'localEndpoints': endpoints,
+                    'endpoints': mapped_endpoints,
+                    'containerDetails': {
+                        'id': container_id,
+                        'model': request.model_id,
+                        'hostPort': host_port,  # Using the unique host port
+                        'containerPort': 2242
+                    },
+                    'status': 'active',
+                    'updatedAt': firestore.SERVER_TIMESTAMP,
+                    'deploymentCompleted': firestore.SERVER_TIMESTAMP,
+                    'deploymentDuration': (datetime.now() - start_time).total_seconds(),
+                })
+                _publish_terminal_state(async_db, deployment_id, pending)
+                logger.info(f"Updating deployment {deployment_id} with complete details including tunnel URL: {tunnel_url}")
             
             logger.info(f"Deployment {deployment_id} completed successfully on port {host_port}")
             
+        except asyncio.CancelledError:
+            # Cancelled by uvicorn once its graceful shutdown timeout passes; record
+            # the failure before the lifespan drains pending commits
+            logger.error(f"Deployment {deployment_id} interrupted by shutdown")
+            if async_db:
+                pending.update({
+                    'status': 'failed',
+                    'error': "Deployment interrupted by API shutdown",
+                    'failedAt': firestore.SERVER_TIMESTAMP,
+                    'deploymentDuration': (datetime.now() - start_time).total_seconds(),
+                    'updatedAt': firestore.SERVER_TIMESTAMP
+                })
+                if state.get('machine_id'):
+                    pending['machineId'] = state['machine_id']
+                if state.get('container_id'):
+                    pending['containerId'] = state['container_id']
+                _publish_terminal_state(async_db, deployment_id, pending)
+            raise
+            
         except Exception as e:
             error_msg = f"Deployment failed: {str(e)}"
             logger.error(error_msg)
-            if db:
-                error_data = {
+            if async_db:
+                # Keep whatever machine/container info was gathered before the failure
+                pending.update({
                     'status': 'failed',
                     'error': error_msg,
                     'failedAt': firestore.SERVER_TIMESTAMP,
                     'deploymentDuration': (datetime.now() - start_time).total_seconds(),
                     'updatedAt': firestore.SERVER_TIMESTAMP
-                }
-                # If we have container info, add it
-                if 'container_id' in locals() and container_id:
-                    error_data['containerId'] = container_id
-                    error_data['containerStatus'] = 'error'
-                
-                # If we have machine info, add it
-                if 'machine_id' in locals() and machine_id:
-                    error_data['machineId'] = machine_id
+                })
+                if state.get('machine_id'):
+                    pending['machineId'] = state['machine_id']
+                if state.get('container_id'):
+                    pending['containerId'] = state['container_id']
+                if pending.get('containerId'):
+                    pending['containerStatus'] = 'error'
                 
-                db.collection('deployments').document(deployment_id).update(error_data)
-        finally:
-            if ssh_client:
-                ssh_client.close()
+                _publish_terminal_state(async_db, deployment_id, pending)
             
     except Exception as e:
         logger.error(f"Unhandled error in deploy_model: {str(e)}")
-        if db:
-            db.collection('deployments').document(deployment_id).update({
+        if async_db:
+            pending.update({
                 'status': 'failed',
                 'error': f"Unhandled deployment error: {str(e)}",
                 'failedAt': firestore.SERVER_TIMESTAMP,
                 'deploymentDuration': (datetime.now() - start_time).total_seconds(),
                 'updatedAt': firestore.SERVER_TIMESTAMP
-            })
\ No newline at end of file
+            })
+            _publish_terminal_state(async_db, deployment_id, pending)
+    finally:
+        # Without Firestore there is nothing to commit, so drop the progress now
+        if not async_db:
+            clear_progress(deployment_id)
\ No newline at end of file
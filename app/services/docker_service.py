@@ -1,20 +1,42 @@
 import asyncio
+import hashlib
+import io
 import logging
 import re
-from datetime import datetime
+import shlex
+import uuid
 from typing import Dict, Optional
 
+from app.core.config import settings
+from app.services.ssh_service import recv_when_ready, run_command, wait_exit_status
+
 logger = logging.getLogger("docker-service")
 
-async def setup_deployment_files(ssh_client, deployment_id: str, host_port: int = 2242):
-    """Setup deployment files in a unique directory for each deployment"""
-    deployment_dir = f"~/aphrodite-deploy-{deployment_id}"
-    logger.info(f"Setting up deployment directory at {deployment_dir}...")
-    
-    # Create unique directory
-    ssh_client.exec_command(f"mkdir -p {deployment_dir}")
-    
-    dockerfile_content = """FROM python:3.10-slim
+# Log patterns are bytes so raw log output can be scanned without decoding;
+# only matched groups are decoded.
+# Base URL printed by the server, e.g. http://0.0.0.0:2242/
+_PORT_RE = re.compile(rb"http://(?:0\.0\.0\.0|localhost):(\d+)/")
+
+# Log label and URL path for each endpoint Aphrodite prints on startup
+_ENDPOINT_LABELS = {
+    "ui": (r"Kobold Lite UI", r"/?"),
+    "docs": (r"Documentation", r"/redoc"),
+    "completions": (r"Completions API", r"/v1/completions"),
+    "chat": (r"Chat API", r"/v1/chat/completions"),
+    "embeddings": (r"Embeddings API", r"/v1/embeddings"),
+    "tokenization": (r"Tokenization API", r"/v1/tokenize"),
+}
+# All endpoints in one alternation, so each line (or a full log) is scanned
+# in a single pass; the matching group name says which endpoint it was
+_ENDPOINT_SCAN_RE = re.compile("|".join(
+    rf"{label}:\s+(?P<{key}>http://[^:]+:\d+{path})"
+    for key, (label, path) in _ENDPOINT_LABELS.items()
+).encode())
+
+# Build context and compose file shared by every deployment on a host.
+# Per-deployment values come from an env file, so the content is fixed.
+_DOCKERFILE = """# syntax=docker/dockerfile:1.4
+FROM python:3.10-slim
 
 # Install git and curl
 RUN apt-get update && \\
@@ -24,8 +46,13 @@ RUN apt-get update && \\
 # Set working directory
 WORKDIR /app
 
-# Clone aphrodite-engine repo
-RUN git clone https://github.com/PygmalionAI/aphrodite-engine.git /app
+# Fetch aphrodite-engine at APHRODITE_REF: a branch, tag or full commit SHA
+# (git clone --branch cannot take a SHA). A branch is only re-fetched when
+# the ref or this step changes, so pin a tag or SHA for reproducible builds.
+ARG APHRODITE_REF=main
+RUN git init -q /app && \\
+    git -C /app fetch -q --depth 1 https://github.com/PygmalionAI/aphrodite-engine.git $APHRODITE_REF && \\
+    git -C /app checkout -q FETCH_HEAD
 
 # Set environment variables
 ENV APHRODITE_TARGET_DEVICE=openvino
@@ -36,9 +63,11 @@ ENV HF_HOME=/root/.cache/huggingface
 # Create cache directory
 RUN mkdir -p /root/.cache/huggingface/hub
 
-# Install dependencies
-RUN pip install --no-cache-dir -r requirements-openvino.txt && \\
-    pip install --no-cache-dir -e .
+# Install dependencies, keeping pip's download cache between builds. This
+# follows the fetch, so a new ref reruns it; the cache mount keeps that cheap.
+RUN --mount=type=cache,target=/root/.cache/pip,sharing=locked \\
+    pip install -r requirements-openvino.txt && \\
+    pip install -e .
 
 # Copy the entrypoint script
 COPY run_aphrodite.py /app/run_aphrodite.py
@@ -47,28 +76,27 @@ RUN chmod +x /app/run_aphrodite.py
 # Expose the port used by the Aphrodite server
 EXPOSE 2242
 
+# Report healthy once the engine's health endpoint answers; model loading can take a while
+HEALTHCHECK --interval=2s --timeout=2s --start-period=10m --retries=60 \\
+    CMD curl -fsS http://localhost:2242/health || exit 1
+
 # Set entrypoint
 ENTRYPOINT ["python", "/app/run_aphrodite.py"]"""
-    
-    stdin, stdout, stderr = ssh_client.exec_command(f"cat > {deployment_dir}/Dockerfile << 'EOF'\n{dockerfile_content}\nEOF")
-    exit_status = stdout.channel.recv_exit_status()
-    if exit_status != 0:
-        raise Exception(f"Failed to create Dockerfile in {deployment_dir}")
-    
-    docker_compose_content = f"""version: '3.8'
+
+_COMPOSE = """version: '3.8'
 
 services:
   aphrodite-engine:
     build:
       context: .
       dockerfile: Dockerfile
-    image: aphrodite-engine-${{MODEL_ID:-gpt2}}
-    container_name: aphrodite-${{MODEL_ID:-gpt2}}-${{DEPLOYMENT_ID}}
+    image: ${APHRODITE_IMAGE}
+    container_name: ${CONTAINER_NAME}
     ports:
-      - "{host_port}:2242"
+      - "${HOST_PORT}:2242"
     environment:
-      - MODEL_ID=${{MODEL_ID:-gpt2}}
-      - HUGGINGFACE_TOKEN=${{HUGGINGFACE_TOKEN}}
+      - MODEL_ID=${MODEL_ID:-gpt2}
+      - HUGGINGFACE_TOKEN=${HUGGINGFACE_TOKEN}
       - APHRODITE_OPENVINO_KVCACHE_SPACE=8
       - HF_HOME=/root/.cache/huggingface
     volumes:
@@ -77,16 +105,10 @@ services:
 
 volumes:
   huggingface-cache:
-    name: huggingface-cache-${{DEPLOYMENT_ID}}"""
-    
-    stdin, stdout, stderr = ssh_client.exec_command(f"cat > {deployment_dir}/docker-compose.yml << 'EOF'\n{docker_compose_content}\nEOF")
-    exit_status = stdout.channel.recv_exit_status()
-    if exit_status != 0:
-        raise Exception(f"Failed to create docker-compose.yml in {deployment_dir}")
-    
-    run_script_content = """#!/usr/bin/env python3
+    name: huggingface-cache-${DEPLOYMENT_ID}"""
+
+_RUN_SCRIPT = """#!/usr/bin/env python3
 import os
-import subprocess
 import sys
 
 def ensure_huggingface_cache_dir():
@@ -102,7 +124,9 @@ def run_aphrodite():
     env = os.environ.copy()
     env["APHRODITE_OPENVINO_KVCACHE_SPACE"] = os.environ.get("APHRODITE_OPENVINO_KVCACHE_SPACE", "8")
     
-    subprocess.check_call(cmd, env=env)
+    # Replace this process so aphrodite runs as PID 1 and receives docker's signals directly
+    sys.stdout.flush()
+    os.execvpe(cmd[0], cmd, env)
 
 def main():
     huggingface_token = os.environ.get("HUGGINGFACE_TOKEN")
@@ -116,15 +140,142 @@ def main():
 
 if __name__ == "__main__":
     main()"""
+
+# Encoded once, as uploaded
+_DOCKERFILE_BYTES = _DOCKERFILE.encode('utf-8')
+_COMPOSE_BYTES = _COMPOSE.encode('utf-8')
+_RUN_SCRIPT_BYTES = _RUN_SCRIPT.encode('utf-8')
+
+# One build directory and image per host, shared by every deployment. Both
+# are keyed by the file contents and the engine ref, so changing either
+# produces a new directory and image instead of reusing stale ones.
+_BUILD_ID = hashlib.sha256(
+    _DOCKERFILE_BYTES + _COMPOSE_BYTES + _RUN_SCRIPT_BYTES + settings.APHRODITE_REF.encode('utf-8')
+).hexdigest()[:12]
+_IMAGE = f"aphrodite-engine:{_BUILD_ID}"
+# Relative to the login directory, as SFTP paths are
+_BUILD_DIR = f"aphrodite-deploy/{_BUILD_ID}"
+
+# Run in the build directory; only the first deployment on a host pays for
+# the build. BuildKit is needed for the Dockerfile's cache mount. Quiet, so
+# build output does not mix with the launch output.
+_ENSURE_IMAGE = (
+    f"(docker image inspect {_IMAGE} >/dev/null 2>&1 || "
+    f"DOCKER_BUILDKIT=1 docker build -q -t {_IMAGE} "
+    f"--build-arg APHRODITE_REF={shlex.quote(settings.APHRODITE_REF)} . >/dev/null)"
+)
+
+# A first build clones the engine and installs its requirements, and prints
+# nothing while it runs, so the launch gets a long limit
+_LAUNCH_TIMEOUT = 3600.0
+
+def _upload_file(ssh_client, path: str, content: bytes, mode: int):
+    """
+    Write one file over its own SFTP session (SFTPClient is not thread-safe).
+    putfo pipelines the write requests instead of waiting on each one. The file
+    is written under a temporary name and renamed into place, so a concurrent
+    deployment's build never reads a half-written file.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    sftp = ssh_client.open_sftp()
+    try:
+        sftp.putfo(io.BytesIO(content), tmp_path)
+        sftp.chmod(tmp_path, mode)
+        sftp.posix_rename(tmp_path, path)
+    except Exception:
+        try:
+            sftp.remove(tmp_path)
+        except IOError:
+            pass
+        raise
+    finally:
+        sftp.close()
+
+def _prepare_build_dir(ssh_client) -> bool:
+    """
+    Create the shared build directory unless this host already has the build files.
+    Returns True if the files still need to be uploaded.
+    """
+    sftp = ssh_client.open_sftp()
+    try:
+        try:
+            # The compose file is written last, so its presence means the set is complete
+            sftp.stat(f"{_BUILD_DIR}/docker-compose.yml")
+            return False
+        except IOError:
+            pass
+        
+        for path in ("aphrodite-deploy", _BUILD_DIR):
+            try:
+                sftp.mkdir(path)
+            except IOError:
+                # Already there
+                pass
+    finally:
+        sftp.close()
+    return True
+
+async def setup_deployment_files(ssh_client, deployment_id: str, env_vars: Dict[str, str]):
+    """
+    Make sure the host has the shared build files and write the deployment's env file.
+    Returns the build directory and the env file name within it.
+    """
+    deployment_dir = f"~/{_BUILD_DIR}"
+    env_file = f"{deployment_id}.env"
+    logger.info(f"Setting up deployment files in {deployment_dir}...")
+    
+    if any("\n" in value for value in env_vars.values()):
+        raise ValueError("Deployment settings must not contain newlines")
+    env_content = "".join(f"{k}={v}\n" for k, v in env_vars.items()).encode('utf-8')
+    
+    loop = asyncio.get_running_loop()
+    try:
+        if await loop.run_in_executor(None, _prepare_build_dir, ssh_client):
+            # Upload concurrently, bypassing the remote shell entirely
+            await asyncio.gather(
+                loop.run_in_executor(None, _upload_file, ssh_client, f"{_BUILD_DIR}/Dockerfile", _DOCKERFILE_BYTES, 0o644),
+                loop.run_in_executor(None, _upload_file, ssh_client, f"{_BUILD_DIR}/run_aphrodite.py", _RUN_SCRIPT_BYTES, 0o755),
+            )
+            await loop.run_in_executor(None, _upload_file, ssh_client, f"{_BUILD_DIR}/docker-compose.yml", _COMPOSE_BYTES, 0o644)
+        
+        # Holds the Hugging Face token, so only the owner may read it
+        await loop.run_in_executor(None, _upload_file, ssh_client, f"{_BUILD_DIR}/{env_file}", env_content, 0o600)
+    except Exception as e:
+        raise Exception(f"Failed to create deployment files in {deployment_dir}: {str(e)}")
+    
+    logger.info(f"Deployment files ready in {deployment_dir}")
+    return deployment_dir, env_file
+
+async def run_container(ssh_client, deployment_dir: str, env_file: str, deployment_id: str) -> str:
+    """
+    Build the image if needed, start the deployment's container and return its ID,
+    all in one remote command
+    """
+    # Each deployment is its own compose project, so ps -q only ever lists
+    # this deployment's container. Values reach the container through the env
+    # file; the arguments that do go through the shell are quoted.
+    project = shlex.quote(f"aphrodite-{deployment_id}")
+    compose = f"docker-compose -p {project} --env-file {shlex.quote(env_file)}"
+    # The env file holds the Hugging Face token and nothing reads it after
+    # up -d, so it is removed whether or not the launch succeeded
+    launch_command = (
+        f"cd {deployment_dir} && {{ {_ENSURE_IMAGE} "
+        f"&& {compose} up -d && {compose} ps -q aphrodite-engine; }}; "
+        f"status=$?; rm -f {shlex.quote(env_file)}; exit $status"
+    )
     
-    stdin, stdout, stderr = ssh_client.exec_command(f"cat > {deployment_dir}/run_aphrodite.py << 'EOF'\n{run_script_content}\nEOF")
-    exit_status = stdout.channel.recv_exit_status()
-    if exit_status != 0:
-        raise Exception(f"Failed to create run_aphrodite.py in {deployment_dir}")
+    stdin, stdout, stderr = run_command(ssh_client, launch_command, _LAUNCH_TIMEOUT)
+    exit_status = wait_exit_status(stdout.channel, _LAUNCH_TIMEOUT)
+    stdout_output = stdout.read().decode('utf-8')
+    stderr_output = stderr.read().decode('utf-8')
     
-    ssh_client.exec_command(f"chmod +x {deployment_dir}/run_aphrodite.py")
-    logger.info(f"Deployment files created successfully in {deployment_dir}")
-    return deployment_dir
+    if exit_status != 0 or "Error" in stderr_output:
+        error_msg = f"Error launching container: {stderr_output}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+    
+    lines = stdout_output.split()
+    return lines[-1] if lines else ""
 
 async def setup_container(ssh_client, model_id: str, user_id: str, 
                         host_port: int = 2242, huggingface_token: Optional[str] = None,
@@ -135,20 +286,16 @@ async def setup_container(ssh_client, model_id: str, user_id: str,
     if not deployment_id:
         raise ValueError("deployment_id is required for container setup")
     
-    # Create deployment directory with unique files
-    deployment_dir = await setup_deployment_files(ssh_client, deployment_id, host_port)
-    
-    logger.info(f"Launching container for model {model_id} on port {host_port}...")
-    
     # Sanitize model_id for Docker naming conventions
     original_model_id = model_id
     safe_model_id = model_id.lower().replace("/", "-")
     
     # Create unique and persistent names
     container_name = f"aphrodite-{safe_model_id}-{deployment_id}"
-    image_name = f"aphrodite-engine-{safe_model_id}"
     
     env_vars = {
+        "APHRODITE_IMAGE": _IMAGE,
+        "CONTAINER_NAME": container_name,
         "MODEL_ID": original_model_id,
         "HOST_PORT": str(host_port),
         "USER_ID": user_id,
@@ -156,24 +303,11 @@ async def setup_container(ssh_client, model_id: str, user_id: str,
         "HUGGINGFACE_TOKEN": huggingface_token or ""
     }
     
-    # Launch the container using the unique deployment directory
-    env_string = " ".join([f"{k}={v}" for k, v in env_vars.items()])
-    launch_command = f"cd {deployment_dir} && {env_string} docker-compose up -d --build"
+    # Shared build files plus this deployment's env file
+    deployment_dir, env_file = await setup_deployment_files(ssh_client, deployment_id, env_vars)
     
-    stdin, stdout, stderr = ssh_client.exec_command(launch_command)
-    exit_status = stdout.channel.recv_exit_status()
-    stderr_output = stderr.read().decode('utf-8')
-    
-    if exit_status != 0 or "Error" in stderr_output:
-        error_msg = f"Error launching container: {stderr_output}"
-        logger.error(error_msg)
-        raise Exception(error_msg)
-    
-    # Get the container ID
-    stdin, stdout, stderr = ssh_client.exec_command(
-        f"docker ps --filter name={container_name} --format '{{{{.ID}}}}'"
-    )
-    container_id = stdout.read().decode('utf-8').strip()
+    logger.info(f"Launching container for model {model_id} on port {host_port}...")
+    container_id = await run_container(ssh_client, deployment_dir, env_file, deployment_id)
     
     if not container_id:
         error_msg = f"Failed to get container ID for {container_name}"
@@ -183,135 +317,188 @@ async def setup_container(ssh_client, model_id: str, user_id: str,
     logger.info(f"Container {container_name} (ID: {container_id}) launched successfully on port {host_port}")
     return container_id
 
-async def monitor_container_startup(ssh_client, container_id: str, host_port: int = 2242, timeout: int = 600):
+def _endpoints_for_port(port) -> Dict[str, str]:
     """
-    Monitor container logs with improved endpoint extraction.
-    Uses a longer timeout and better error handling.
+    Endpoints Aphrodite serves on the given host port
     """
-    logger.info(f"Monitoring container {container_id} startup with port {host_port}...")
-    
-    # First try with log following (real-time)
-    log_command = f"docker logs -f {container_id}"
-    stdin, stdout, stderr = ssh_client.exec_command(log_command)
-    
-    endpoints = {}
-    startup_complete = False
-    start_time = datetime.now()
-    
-    # Port patterns to check
-    port_patterns = [
-        f"http://0.0.0.0:{host_port}/",
-        f"http://localhost:{host_port}/",
-        r"http://0.0.0.0:\d+/",
-        r"http://localhost:\d+/"
-    ]
+    base_url = f"http://localhost:{port}"
+    return {
+        "base_url": f"{base_url}/",
+        "ui": f"{base_url}/",
+        "docs": f"{base_url}/redoc",
+        "completions": f"{base_url}/v1/completions",
+        "chat": f"{base_url}/v1/chat/completions",
+        "embeddings": f"{base_url}/v1/embeddings",
+        "tokenization": f"{base_url}/v1/tokenize"
+    }
+
+async def _wait_until_healthy(ssh_client, container_id: str, timeout: int) -> bool:
+    """
+    Wait for Docker to report the container healthy via its HEALTHCHECK.
+    Returns False on an unhealthy report or if the event stream ends.
+    """
+    # Replay events since the container was created so a transition that
+    # happened before we subscribed is not missed. Exits straight away if the
+    # image has no HEALTHCHECK, so we fall back without waiting out the timeout.
+    # docker events only writes on a health change, so closing the channel would
+    # not stop it; timeout ends it on the host along with our wait.
+    events_command = (
+        f"created=$(docker inspect -f '{{{{if .Config.Healthcheck}}}}{{{{.Created}}}}{{{{end}}}}' {container_id}) "
+        f"&& [ -n \"$created\" ] "
+        f"&& timeout {timeout} docker events --since \"$created\" "
+        f"--filter container={container_id} --filter event=health_status "
+        f"--format '{{{{.Status}}}}'"
+    )
+    stdin, stdout, stderr = run_command(ssh_client, events_command, timeout)
     
-    while not startup_complete and (datetime.now() - start_time).total_seconds() < timeout:
-        if stdout.channel.recv_ready():
-            line = stdout.channel.recv(1024).decode('utf-8')
-            
-            # Check for base URL with dynamic port detection
-            for pattern in port_patterns:
-                if re.search(pattern, line):
-                    # Extract actual port from the line
-                    port_match = re.search(r"http://[^:]+:(\d+)/", line)
-                    actual_port = port_match.group(1) if port_match else str(host_port)
-                    endpoints["base_url"] = f"http://localhost:{actual_port}/"
-                    break
+    buf = bytearray()
+    try:
+        while True:
+            chunk = await recv_when_ready(stdout.channel)
+            if not chunk:
+                return False
             
-            # Dynamic endpoint pattern dictionary
-            endpoint_patterns = {
-                "ui": r"Kobold Lite UI:\s+(http://[^:]+:(\d+)/?)",
-                "docs": r"Documentation:\s+(http://[^:]+:(\d+)/redoc)",
-                "completions": r"Completions API:\s+(http://[^:]+:(\d+)/v1/completions)",
-                "chat": r"Chat API:\s+(http://[^:]+:(\d+)/v1/chat/completions)",
-                "embeddings": r"Embeddings API:\s+(http://[^:]+:(\d+)/v1/embeddings)",
-                "tokenization": r"Tokenization API:\s+(http://[^:]+:(\d+)/v1/tokenize)"
-            }
+            buf += chunk
+            *lines, rest = buf.split(b"\n")
+            buf = bytearray(rest)
             
-            for key, pattern in endpoint_patterns.items():
-                match = re.search(pattern, line)
-                if match:
-                    # Replace the host with localhost
-                    endpoints[key] = match.group(1).replace("0.0.0.0", "localhost")
-                    # Extract the actual port for default endpoints
-                    if "actual_port" not in locals():
-                        actual_port = match.group(2)
+            # Each line looks like "health_status: healthy"
+            for line in lines:
+                status = line.decode('utf-8', 'replace').strip()
+                if status.endswith(": healthy"):
+                    return True
+                if status.endswith(": unhealthy"):
+                    logger.warning(f"Container {container_id} reported unhealthy")
+                    return False
+    finally:
+        stdout.channel.close()
+
+async def _watch_logs(ssh_client, container_id: str, endpoints: Dict[str, str], timeout: float) -> bool:
+    """
+    Follow the container logs, recording endpoints as they are printed.
+    Returns True once startup is complete, False if the log stream ends first.
+    """
+    # Closing the channel does not stop docker logs -f, so it is bounded on the host too
+    stdin, stdout, stderr = run_command(
+        ssh_client, f"timeout {timeout:.0f} docker logs -f {container_id}", timeout
+    )
+    
+    # Log bytes not yet terminated by a newline
+    buf = bytearray()
+    try:
+        while True:
+            chunk = await recv_when_ready(stdout.channel)
+            if not chunk:
+                # Log stream ended (container exited or channel closed)
+                return False
             
-            if "Application startup complete" in line:
-                startup_complete = True
-                break
+            buf += chunk
+            *lines, rest = buf.split(b"\n")
+            buf = bytearray(rest)
             
-            # Also detect if all endpoints have been found
-            if len(endpoints) >= 6:  # We expect 6 endpoints
-                startup_complete = True
-                break
-        
-        await asyncio.sleep(0.1)
+            for line in lines:
+                # Check for base URL with dynamic port detection
+                port_match = _PORT_RE.search(line)
+                if port_match:
+                    endpoints["base_url"] = f"http://localhost:{port_match.group(1).decode('ascii')}/"
+                
+                for match in _ENDPOINT_SCAN_RE.finditer(line):
+                    key = match.lastgroup
+                    # Replace the host with localhost
+                    endpoints[key] = match.group(key).decode('utf-8', 'replace').replace("0.0.0.0", "localhost")
+                
+                if b"Application startup complete" in line:
+                    return True
+                
+                # Also stop once every endpoint has been printed
+                if endpoints.keys() >= _ENDPOINT_LABELS.keys():
+                    return True
+    finally:
+        stdout.channel.close()
+
+async def monitor_container_startup(ssh_client, container_id: str, host_port: int = 2242, timeout: int = 600):
+    """
+    Wait for the container to become ready and return its endpoints.
+    Endpoints are derived from the port once the container reports healthy;
+    otherwise they are read from its logs.
+    """
+    logger.info(f"Monitoring container {container_id} startup with port {host_port}...")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    
+    try:
+        healthy = await asyncio.wait_for(_wait_until_healthy(ssh_client, container_id, timeout), timeout)
+    except asyncio.TimeoutError:
+        healthy = False
+    
+    if healthy:
+        logger.info(f"Container {container_id} is healthy")
+        return _endpoints_for_port(host_port)
+    
+    # Running and published is not the same as ready (the model may still be
+    # loading or broken), so without a healthy report the logs decide
+    logger.warning(f"No healthy status for container {container_id}, falling back to its logs")
     
-    stdout.channel.close()
+    # Follow the logs (real-time) for whatever time is left
+    endpoints = {}
+    startup_complete = False
+    timed_out = True
+    remaining = deadline - loop.time()
+    if remaining > 0:
+        try:
+            startup_complete = await asyncio.wait_for(
+                _watch_logs(ssh_client, container_id, endpoints, remaining), remaining
+            )
+            timed_out = False
+        except asyncio.TimeoutError:
+            pass
     
-    # If we didn't get all endpoints, try fetching the entire log
-    if not startup_complete or len(endpoints) < 6:
+    # docker logs -f replays the whole log, so a second full read can only
+    # add something if following was cut short by the deadline
+    if timed_out:
         logger.info("Trying to extract endpoints from complete logs...")
-        stdin, stdout, stderr = ssh_client.exec_command(f"docker logs {container_id}")
-        full_logs = stdout.read().decode('utf-8')
+        stdin, stdout, stderr = run_command(ssh_client, f"docker logs {container_id}")
+        full_logs = stdout.read()
         
         # Try to detect the actual port first
-        actual_port = str(host_port)
-        for pattern in port_patterns:
-            port_match = re.search(pattern, full_logs)
-            if port_match:
-                port_extract = re.search(r"http://[^:]+:(\d+)/", port_match.group(0))
-                if port_extract:
-                    actual_port = port_extract.group(1)
-                    break
+        port_match = _PORT_RE.search(full_logs)
+        actual_port = port_match.group(1).decode('ascii') if port_match else str(host_port)
         
         # Set base_url if not already set
         if "base_url" not in endpoints:
             endpoints["base_url"] = f"http://localhost:{actual_port}/"
         
-        # Try to find missing endpoints in the full logs
-        for key, pattern in endpoint_patterns.items():
+        # Try to find missing endpoints in the full logs, in one pass
+        for match in _ENDPOINT_SCAN_RE.finditer(full_logs):
+            key = match.lastgroup
             if key not in endpoints:
-                match = re.search(pattern, full_logs)
-                if match:
-                    endpoints[key] = match.group(1).replace("0.0.0.0", "localhost")
+                endpoints[key] = match.group(key).decode('utf-8', 'replace').replace("0.0.0.0", "localhost")
         
-        if "Application startup complete" in full_logs:
+        if b"Application startup complete" in full_logs:
             startup_complete = True
     
     # Last resort - if container is running but we don't have endpoints,
     # use default endpoints based on port
     if len(endpoints) == 0 or "base_url" not in endpoints:
-        stdin, stdout, stderr = ssh_client.exec_command(f"docker inspect -f '{{{{.State.Running}}}}' {container_id}")
-        is_running = stdout.read().decode('utf-8').strip() == "true"
-        
-        if is_running:
-            # Try to find the actual mapped port
-            stdin, stdout, stderr = ssh_client.exec_command(
-                f"docker port {container_id} | grep -m 1 '0.0.0.0' | cut -d ':' -f 2"
-            )
-            detected_port = stdout.read().decode('utf-8').strip()
-            actual_port = detected_port if detected_port else str(host_port)
+        # Running state and the host port published for the server, in one call
+        stdin, stdout, stderr = run_command(
+            ssh_client,
+            f"docker inspect -f '{{{{.State.Running}}}} "
+            f"{{{{with index .NetworkSettings.Ports \"2242/tcp\"}}}}{{{{(index . 0).HostPort}}}}{{{{end}}}}' {container_id}"
+        )
+        is_running, _, mapped_port = stdout.read().decode('utf-8').strip().partition(" ")
+        if is_running == "true":
+            actual_port = mapped_port or str(host_port)
             
             logger.warning(f"Using default endpoint configuration with port {actual_port}")
-            endpoints = {
-                "base_url": f"http://localhost:{actual_port}/",
-                "ui": f"http://localhost:{actual_port}/",
-                "docs": f"http://localhost:{actual_port}/redoc",
-                "completions": f"http://localhost:{actual_port}/v1/completions",
-                "chat": f"http://localhost:{actual_port}/v1/chat/completions",
-                "embeddings": f"http://localhost:{actual_port}/v1/embeddings",
-                "tokenization": f"http://localhost:{actual_port}/v1/tokenize"
-            }
+            endpoints = _endpoints_for_port(actual_port)
             startup_complete = True
     
     if not startup_complete:
         logger.warning(f"Container startup monitoring timed out after {timeout} seconds")
         
         # Check container status for debugging
-        stdin, stdout, stderr = ssh_client.exec_command(f"docker inspect {container_id}")
+        stdin, stdout, stderr = run_command(ssh_client, f"docker inspect {container_id}")
         container_info = stdout.read().decode('utf-8')
         logger.info(f"Container inspection: {container_info[:500]}...")
     
@@ -4,14 +4,28 @@ import asyncio
 import logging
 import time
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import httpx
+from firebase_admin import firestore
 
-# Import Firebase db from your existing initialization
-from app.db.firebase import db
+from app.db.firebase import get_async_db
 
 logger = logging.getLogger("monitor-service")
 
+# One client for all status checks, so connections are kept alive across
+# deployments and monitor runs instead of being opened per request
+_http_client = httpx.AsyncClient(
+    timeout=30.0,
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=50)
+)
+
+# Caps how many status requests are in flight at once
+MAX_CONCURRENT_CHECKS = 20
+_check_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+
+# Firestore's limit on writes per batch
+_MAX_BATCH_WRITES = 500
+
 async def monitor_deployments():
     """
     Monitor all deployments that are in polling state
@@ -21,27 +35,27 @@ async def monitor_deployments():
     
     try:
         # Query all deployments that are in 'queued' or other non-final states and have isPolling=true
-        monitor_ref = db.collection('monitor')
+        async_db = get_async_db()
+        monitor_ref = async_db.collection('monitor')
         query = monitor_ref.where('isPolling', '==', True)
-        docs = query.stream()
         
-        deployments = list(docs)
-        if not deployments:
+        # Start checking each deployment as soon as its document arrives,
+        # rather than after the whole query has been read
+        refs = []
+        tasks = []
+        async for doc in query.stream():
+            refs.append(doc.reference)
+            tasks.append(asyncio.create_task(check_deployment_status(doc.id, doc.to_dict())))
+        
+        if not tasks:
             logger.info("No deployments to monitor.")
             return
         
-        logger.info(f"Found {len(deployments)} deployments to monitor.")
+        logger.info(f"Found {len(tasks)} deployments to monitor.")
         
-        # Process each deployment using asyncio
-        tasks = []
-        for doc in deployments:
-            deployment = doc.to_dict()
-            deployment_id = doc.id
-            tasks.append(check_deployment_status(doc.reference, deployment_id, deployment))
-        
-        # Wait for all tasks to complete
-        if tasks:
-            await asyncio.gather(*tasks)
+        # Wait for all tasks to complete, then write their results together
+        results = await asyncio.gather(*tasks)
+        await write_status_updates(async_db, list(zip(refs, results)))
         
         logger.info("Deployment monitoring completed.")
         
@@ -49,9 +63,9 @@ async def monitor_deployments():
         logger.exception(f"Error in deployment monitoring: {str(e)}")
 
 
-async def check_deployment_status(doc_ref, deployment_id: str, deployment: Dict[str, Any]):
+async def check_deployment_status(deployment_id: str, deployment: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Check the status of a single deployment and update its status in Firebase
+    Check the status of a single deployment and return the fields to update in Firebase
     """
     logger.info(f"Checking status for deployment {deployment_id} ({deployment.get('modelId')})...")
     
@@ -60,100 +74,107 @@ async def check_deployment_status(doc_ref, deployment_id: str, deployment: Dict[
         monitor_url = deployment.get('monitorUrl')
         if not monitor_url:
             logger.error(f"Missing monitor URL for deployment {deployment_id}")
-            await update_deployment_status(doc_ref, {
+            return {
                 'isPolling': False,
                 'errorMessage': 'Missing monitor URL',
                 'updatedAt': datetime.now().isoformat()
-            })
-            return
+            }
         
         # Extract the deployment ID from the URL
         import re
         url_match = re.search(r'/deployments/([^/]+)/status', monitor_url)
         if not url_match:
             logger.error(f"Invalid monitor URL format: {monitor_url}")
-            await update_deployment_status(doc_ref, {
+            return {
                 'isPolling': False,
                 'errorMessage': 'Invalid monitor URL format',
                 'updatedAt': datetime.now().isoformat()
-            })
-            return
+            }
         
         api_deployment_id = url_match.group(1)
         
         # Make request to the deployment status endpoint
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            headers = {
-                'Accept': 'application/json',
-                'User-Agent': 'DeploymentMonitorService/1.0',  # Custom user agent
-                'Cache-Control': 'no-cache'
-            }
-            
-            logger.info(f"Requesting status from: {monitor_url}")
-            response = await client.get(monitor_url, headers=headers)
-            
-            # Check if response is successful
-            if response.status_code != 200:
-                logger.error(f"Error response {response.status_code} for deployment {deployment_id}")
-                await update_deployment_status(doc_ref, {
-                    'lastErrorMessage': f"HTTP Error: {response.status_code}",
-                    'updatedAt': datetime.now().isoformat()
-                })
-                return
-            
-            # Parse response data
-            data = response.json()
-            logger.info(f"Received status for deployment {deployment_id}: {data.get('status')}")
-            
-            # Prepare update data
-            from firebase_admin import firestore
-            update_data = {
-                'status': data.get('status'),
-                'progress': data.get('progress', 0),
-                'updatedAt': firestore.SERVER_TIMESTAMP
+        headers = {
+            'Accept': 'application/json',
+            'User-Agent': 'DeploymentMonitorService/1.0',  # Custom user agent
+            'Cache-Control': 'no-cache'
+        }
+        
+        logger.info(f"Requesting status from: {monitor_url}")
+        async with _check_semaphore:
+            response = await _http_client.get(monitor_url, headers=headers)
+        
+        # Check if response is successful
+        if response.status_code != 200:
+            logger.error(f"Error response {response.status_code} for deployment {deployment_id}")
+            return {
+                'lastErrorMessage': f"HTTP Error: {response.status_code}",
+                'updatedAt': datetime.now().isoformat()
             }
-            
-            # Add tunnel URL if it exists
-            if 'tunnel_url' in data:
-                update_data['tunnelUrl'] = data['tunnel_url']
-            
-            # Add endpoints if they exist
-            if 'endpoints' in data:
-                update_data['endpoints'] = data['endpoints']
-            
-            # Add deployment completion info if active
-            if data.get('status') == 'active' and 'deployment_completed' in data:
-                update_data['deploymentCompleted'] = data['deployment_completed']
-                update_data['deploymentDuration'] = data['deployment_duration']
-                update_data['isPolling'] = False  # Stop polling once active
-            
-            # If status is 'failed', stop polling
-            if data.get('status') == 'failed':
-                update_data['isPolling'] = False
-                update_data['errorMessage'] = data.get('error', 'Deployment failed')
-            
-            # Update the document
-            await update_deployment_status(doc_ref, update_data)
+        
+        # Parse response data
+        data = response.json()
+        logger.info(f"Received status for deployment {deployment_id}: {data.get('status')}")
+        
+        # Prepare update data
+        update_data = {
+            'status': data.get('status'),
+            'progress': data.get('progress', 0),
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        }
+        
+        # Add tunnel URL if it exists
+        if 'tunnel_url' in data:
+            update_data['tunnelUrl'] = data['tunnel_url']
+        
+        # Add endpoints if they exist
+        if 'endpoints' in data:
+            update_data['endpoints'] = data['endpoints']
+        
+        # Add deployment completion info if active
+        if data.get('status') == 'active' and 'deployment_completed' in data:
+            update_data['deploymentCompleted'] = data['deployment_completed']
+            update_data['deploymentDuration'] = data['deployment_duration']
+            update_data['isPolling'] = False  # Stop polling once active
+        
+        # If status is 'failed', stop polling
+        if data.get('status') == 'failed':
+            update_data['isPolling'] = False
+            update_data['errorMessage'] = data.get('error', 'Deployment failed')
+        
+        return update_data
             
     except Exception as e:
         logger.exception(f"Error monitoring deployment {deployment_id}: {str(e)}")
         
         # Don't change polling status yet, will retry on next run
-        await update_deployment_status(doc_ref, {
+        return {
             'lastErrorMessage': str(e),
             'updatedAt': datetime.now().isoformat()
-        })
+        }
 
 
-async def update_deployment_status(doc_ref, update_data: Dict[str, Any]):
+async def write_status_updates(async_db, updates: List[Tuple[Any, Dict[str, Any]]]):
     """
-    Update a deployment status in Firebase
+    Write the status updates from one monitor run in batched commits
     """
-    try:
-        doc_ref.update(update_data)
-        logger.info(f"Updated deployment {doc_ref.id}")
-    except Exception as e:
-        logger.exception(f"Error updating deployment {doc_ref.id}: {str(e)}")
+    for start in range(0, len(updates), _MAX_BATCH_WRITES):
+        chunk = updates[start:start + _MAX_BATCH_WRITES]
+        try:
+            batch = async_db.batch()
+            for doc_ref, update_data in chunk:
+                batch.update(doc_ref, update_data)
+            await batch.commit()
+            logger.info(f"Updated {len(chunk)} deployments")
+        except Exception as e:
+            logger.exception(f"Error updating {len(chunk)} deployments: {str(e)}")
+
+
+async def close_http_client():
+    """
+    Close the shared status-check client (called on application shutdown)
+    """
+    await _http_client.aclose()
 
 
 async def start_monitor_scheduler(interval_seconds=5):
@@ -0,0 +1,147 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+import paramiko
+
+from app.models.ssh import SSHConfig
+from app.services.ssh_service import connect_ssh
+
+logger = logging.getLogger("ssh-pool")
+
+# Idle connections older than this are closed instead of reused
+IDLE_TIMEOUT = 900
+KEEPALIVE_INTERVAL = 30
+# Idle connections kept per host; extras from a burst of deployments are closed on release
+MAX_IDLE_PER_KEY = 2
+
+# Idle authenticated clients per (host, port, username, password, key_file).
+# Credentials are part of the key so a session is only reused by a caller
+# that could have opened it itself.
+_pool: Dict[Tuple, List[Tuple[float, paramiko.SSHClient]]] = {}
+# Clients currently lent out, so shutdown can close them under blocked workers
+_checked_out: Set[paramiko.SSHClient] = set()
+_lock = threading.Lock()
+
+def _pool_key(ssh_config: SSHConfig) -> Tuple:
+    return (ssh_config.host, ssh_config.port, ssh_config.username,
+            ssh_config.password, ssh_config.key_file)
+
+def _is_active(client: paramiko.SSHClient) -> bool:
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+def checkout(ssh_config: SSHConfig) -> paramiko.SSHClient:
+    """
+    Take a live idle client for this host out of the pool, or connect a new one.
+    Blocking; call from a worker thread.
+    """
+    key = _pool_key(ssh_config)
+    now = time.monotonic()
+    client: Optional[paramiko.SSHClient] = None
+    stale = []
+
+    with _lock:
+        idle = _pool.get(key, [])
+        while idle:
+            released_at, candidate = idle.pop()
+            if now - released_at < IDLE_TIMEOUT and _is_active(candidate):
+                client = candidate
+                break
+            stale.append(candidate)
+
+    for old in stale:
+        old.close()
+
+    if client is not None:
+        logger.info(f"Reusing SSH connection to {ssh_config.host}")
+        with _lock:
+            _checked_out.add(client)
+        return client
+
+    client = connect_ssh(
+        hostname=ssh_config.host,
+        username=ssh_config.username,
+        port=ssh_config.port,
+        password=ssh_config.password,
+        key_filename=ssh_config.key_file
+    )
+    client.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+    with _lock:
+        _checked_out.add(client)
+    return client
+
+def release(ssh_config: SSHConfig, client: paramiko.SSHClient):
+    """
+    Return a client to the pool, or close it if its transport has died
+    """
+    with _lock:
+        _checked_out.discard(client)
+    
+    if not _is_active(client):
+        client.close()
+        return
+
+    with _lock:
+        idle = _pool.setdefault(_pool_key(ssh_config), [])
+        idle.append((time.monotonic(), client))
+        # Keep the most recently released clients
+        surplus = [old for _, old in idle[:-MAX_IDLE_PER_KEY]]
+        del idle[:-MAX_IDLE_PER_KEY]
+
+    for old in surplus:
+        old.close()
+    evict_idle()
+
+def evict_idle():
+    """
+    Close idle clients older than IDLE_TIMEOUT for every host, not just the one in use.
+    Called on release and periodically by the application.
+    """
+    cutoff = time.monotonic() - IDLE_TIMEOUT
+    expired = []
+
+    with _lock:
+        for key in list(_pool):
+            idle = _pool[key]
+            expired.extend(client for released_at, client in idle if released_at <= cutoff)
+            idle[:] = [(released_at, client) for released_at, client in idle if released_at > cutoff]
+            if not idle:
+                del _pool[key]
+
+    for client in expired:
+        client.close()
+
+def close_all():
+    """
+    Close every pooled connection, including ones still checked out.
+    Workers blocked on a checked-out client then fail instead of holding up shutdown.
+    """
+    with _lock:
+        clients = [client for idle in _pool.values() for _, client in idle]
+        clients.extend(_checked_out)
+        _pool.clear()
+        _checked_out.clear()
+
+    for client in clients:
+        client.close()
+
+# The app's lifespan closes the pool on shutdown; this also covers scripts
+# and workers that use the pool without it
+atexit.register(close_all)
+
+@asynccontextmanager
+async def acquire(ssh_config: SSHConfig):
+    """
+    Borrow an SSH client for the duration of the block
+    """
+    loop = asyncio.get_running_loop()
+    client = await loop.run_in_executor(None, checkout, ssh_config)
+    try:
+        yield client
+    finally:
+        release(ssh_config, client)
\ No newline at end of file
@@ -1,11 +1,16 @@
 import asyncio
 import logging
+import socket
 from typing import Optional
 
 import paramiko
 
 logger = logging.getLogger("ssh-service")
 
+# Limits for remote commands, so a hung host fails the step instead of blocking it forever
+COMMAND_TIMEOUT = 15.0
+INSTALL_TIMEOUT = 120.0
+
 def connect_ssh(hostname: str, username: str, port: int = 22, 
                 password: Optional[str] = None, key_filename: Optional[str] = None):
     ssh_client = paramiko.SSHClient()
@@ -17,7 +22,9 @@ def connect_ssh(hostname: str, username: str, port: int = 22,
         'port': port,
         'password': password,
         'allow_agent': False,    # Force password authentication
-        'look_for_keys': False   # Prevent using SSH keys
+        'look_for_keys': False,  # Prevent using SSH keys
+        'compress': True,        # Log streams and file uploads are text and compress well
+        'banner_timeout': 10     # Fail fast on hosts that accept TCP but never start SSH
     }
     
     # If a key filename is provided, remove the password and update connect_kwargs
@@ -27,38 +34,62 @@ def connect_ssh(hostname: str, username: str, port: int = 22,
 
     logger.info(f"Connecting to {hostname}...")
     ssh_client.connect(**connect_kwargs)
+    
+    # Send small exec/channel packets immediately instead of waiting on Nagle
+    ssh_client.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     return ssh_client
 
 
+def run_command(ssh_client, command: str, timeout: float = COMMAND_TIMEOUT):
+    """
+    Run a command whose channel reads and writes time out on a hung host.
+    Pair with wait_exit_status to wait for it to finish under the same limit.
+    """
+    return ssh_client.exec_command(command, timeout=timeout)
+
+def wait_exit_status(channel, timeout: float = COMMAND_TIMEOUT) -> int:
+    """
+    Wait for a command's exit status, raising socket.timeout if it does not finish in time
+    """
+    if not channel.status_event.wait(timeout):
+        channel.close()
+        raise socket.timeout(f"Remote command did not finish within {timeout:.0f}s")
+    return channel.recv_exit_status()
+
+async def recv_when_ready(channel, nbytes: int = 4096) -> bytes:
+    """
+    Read from a paramiko channel once data arrives, without polling.
+    Waits on the channel's event fd; returns b"" at end of stream.
+    """
+    loop = asyncio.get_running_loop()
+    while not (channel.recv_ready() or channel.eof_received or channel.closed):
+        ready = loop.create_future()
+        fd = channel.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+    return channel.recv(nbytes)
+
 async def ensure_dependencies(ssh_client, password: Optional[str] = None):
     sudo_prefix = f"echo '{password}' | sudo -S " if password else "sudo "
     
-    stdin, stdout, stderr = ssh_client.exec_command("which node")
-    node_installed = stdout.channel.recv_exit_status() == 0
-    
-    stdin, stdout, stderr = ssh_client.exec_command("which lt")
-    lt_installed = stdout.channel.recv_exit_status() == 0
+    # Check and install everything in one round-trip; the exit status tells
+    # which install failed
+    install_script = (
+        f"command -v node >/dev/null || "
+        f"({sudo_prefix}apt-get update && {sudo_prefix}apt-get install -y nodejs npm) || exit 1\n"
+        f"command -v lt >/dev/null || {sudo_prefix}npm install -g localtunnel || exit 2\n"
+    )
     
-    if not node_installed:
-        logger.info("Installing Node.js...")
-        stdin, stdout, stderr = ssh_client.exec_command(
-            f"{sudo_prefix}apt-get update && {sudo_prefix}apt-get install -y nodejs npm"
-        )
-        exit_status = stdout.channel.recv_exit_status()
-        if exit_status != 0:
-            error_msg = stderr.read().decode('utf-8')
+    logger.info("Checking Node.js and localtunnel...")
+    stdin, stdout, stderr = run_command(ssh_client, install_script, INSTALL_TIMEOUT)
+    exit_status = wait_exit_status(stdout.channel, INSTALL_TIMEOUT)
+    if exit_status != 0:
+        error_msg = stderr.read().decode('utf-8')
+        if exit_status == 1:
             raise Exception(f"Failed to install Node.js: {error_msg}")
-        await asyncio.sleep(2)
-    
-    if not lt_installed:
-        logger.info("Installing localtunnel...")
-        stdin, stdout, stderr = ssh_client.exec_command(
-            f"{sudo_prefix}npm install -g localtunnel"
-        )
-        exit_status = stdout.channel.recv_exit_status()
-        if exit_status != 0:
-            error_msg = stderr.read().decode('utf-8')
-            raise Exception(f"Failed to install localtunnel: {error_msg}")
-        await asyncio.sleep(2)
+        raise Exception(f"Failed to install localtunnel: {error_msg}")
     
     logger.info("Dependencies check completed")
\ No newline at end of file
@@ -2,107 +2,218 @@ import asyncio
 import logging
 import os
 import re
+import socket
+import threading
+
+from cachetools import TTLCache
+
+from app.core.config import settings
+from app.services.ssh_service import (INSTALL_TIMEOUT, recv_when_ready, run_command,
+                                      wait_exit_status)
 
 logger = logging.getLogger("tunnel-service")
 
+# Limits how many tunnel setups run at once. Setups run on deploy pool threads,
+# each with its own event loop, so this is a thread semaphore rather than an
+# asyncio one (which is bound to a single loop). The pool size already caps
+# concurrency, so the limit is clamped to it.
+_SETUP_SEM = threading.BoundedSemaphore(
+    max(1, min(settings.TUNNEL_MAX_CONCURRENCY, settings.MAX_CONCURRENT_DEPLOYMENTS))
+)
+
+# Hosts where localtunnel is known to be installed, keyed by (peer address, username)
+_LT_CACHE = TTLCache(maxsize=1024, ttl=900)
+_lt_cache_lock = threading.Lock()
+
+# The trailing whitespace keeps a partially written line from matching a truncated URL
+_URL_RE = re.compile(rb'your url is: (https://\S+)\s')
+
+# Longest partial log line kept while waiting for the URL
+_MAX_LINE_BYTES = 64 * 1024
+
+# How long each attempt waits for the tunnel to print its URL
+_URL_WAIT_TIMEOUT = 15.0
+
+def _lt_cache_key(ssh_client):
+    transport = ssh_client.get_transport()
+    return (transport.getpeername(), transport.get_username())
+
 async def verify_localtunnel_installation(ssh_client, password=None):
     """Verify and fix localtunnel installation if needed"""
-    stdin, stdout, stderr = ssh_client.exec_command("which lt")
-    exit_status = stdout.channel.recv_exit_status()
+    cache_key = _lt_cache_key(ssh_client)
+    with _lt_cache_lock:
+        if _LT_CACHE.get(cache_key):
+            return True
+    
+    try:
+        installed = await _install_localtunnel(ssh_client, password)
+    except socket.timeout as e:
+        logger.error(f"Localtunnel check timed out: {str(e)}")
+        return False
+    if installed:
+        with _lt_cache_lock:
+            _LT_CACHE[cache_key] = True
+    return installed
+
+async def _install_localtunnel(ssh_client, password=None):
+    """Install Node.js and localtunnel on the host if lt is missing"""
+    stdin, stdout, stderr = run_command(ssh_client, "which lt")
+    exit_status = wait_exit_status(stdout.channel)
     
     if exit_status != 0:
         logger.warning("Localtunnel not found, attempting to install globally...")
         sudo_prefix = f"echo '{password}' | sudo -S " if password else "sudo "
         
         # Make sure npm is installed
-        stdin, stdout, stderr = ssh_client.exec_command("which npm")
-        if stdout.channel.recv_exit_status() != 0:
+        stdin, stdout, stderr = run_command(ssh_client, "which npm")
+        if wait_exit_status(stdout.channel) != 0:
             logger.warning("npm not found, installing nodejs and npm...")
             install_cmd = f"{sudo_prefix}apt-get update && {sudo_prefix}apt-get install -y nodejs npm"
-            stdin, stdout, stderr = ssh_client.exec_command(install_cmd)
-            if stdout.channel.recv_exit_status() != 0:
+            stdin, stdout, stderr = run_command(ssh_client, install_cmd, INSTALL_TIMEOUT)
+            if wait_exit_status(stdout.channel, INSTALL_TIMEOUT) != 0:
                 logger.error("Failed to install nodejs and npm")
                 return False
             await asyncio.sleep(2)
         
         # Install localtunnel globally
         install_cmd = f"{sudo_prefix}npm install -g localtunnel"
-        stdin, stdout, stderr = ssh_client.exec_command(install_cmd)
-        if stdout.channel.recv_exit_status() != 0:
+        stdin, stdout, stderr = run_command(ssh_client, install_cmd, INSTALL_TIMEOUT)
+        if wait_exit_status(stdout.channel, INSTALL_TIMEOUT) != 0:
             logger.error("Failed to install localtunnel")
             return False
         await asyncio.sleep(2)
     
     return True
 
+def _start_lt(ssh_client, start_script: str) -> bool:
+    """
+    Run the tunnel start script on the host through bash's stdin.
+    Returns False if localtunnel could not be installed or the tunnel not launched.
+    """
+    # The script may install Node.js and localtunnel, so it gets the install limit
+    try:
+        stdin, stdout, stderr = run_command(ssh_client, "bash -s", INSTALL_TIMEOUT)
+        stdin.write(start_script)
+        stdin.channel.shutdown_write()
+        exit_status = wait_exit_status(stdout.channel, INSTALL_TIMEOUT)
+    except socket.timeout as e:
+        logger.error(f"Tunnel start script timed out: {str(e)}")
+        return False
+    if exit_status == 1:
+        logger.error(f"Failed to install localtunnel: {stderr.read().decode('utf-8')}")
+        with _lt_cache_lock:
+            _LT_CACHE.pop(_lt_cache_key(ssh_client), None)
+        return False
+    if exit_status != 0:
+        logger.error(f"Failed to start tunnel process: {stderr.read().decode('utf-8')}")
+        return False
+    return True
+
+async def _read_url(channel):
+    """
+    Read the followed tunnel log until the URL line appears.
+    Returns None if the stream ends first.
+    """
+    buf = bytearray()
+    while True:
+        chunk = await recv_when_ready(channel)
+        if not chunk:
+            return None
+        
+        buf += chunk
+        url_match = _URL_RE.search(buf)
+        if url_match:
+            return url_match.group(1).decode('ascii')
+        
+        # Only the unfinished last line can still match, so drop the complete
+        # lines already searched and cap a runaway line
+        del buf[:buf.rfind(b"\n") + 1]
+        if len(buf) > _MAX_LINE_BYTES:
+            del buf[:-_MAX_LINE_BYTES]
+
+async def _wait_for_url(ssh_client, tunnel_log: str, tunnel_pid: str):
+    """
+    Follow the tunnel log until it prints the URL, then check the URL responds.
+    Returns (url, http status), or (None, None) if the tunnel exits or times out.
+    """
+    # Follow from the start of the log, since lt may already have written the
+    # URL. tail exits by itself if the tunnel process dies; closing the channel
+    # does not stop it, so timeout ends it on the host along with our wait.
+    stdin, stdout, stderr = run_command(
+        ssh_client,
+        f"timeout {_URL_WAIT_TIMEOUT:.0f} tail --pid=$(cat {tunnel_pid}) -n +1 -F {tunnel_log}",
+        _URL_WAIT_TIMEOUT
+    )
+    try:
+        tunnel_url = await asyncio.wait_for(_read_url(stdout.channel), _URL_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Tunnel did not report its URL within {_URL_WAIT_TIMEOUT:.0f}s")
+        return None, None
+    finally:
+        stdout.channel.close()
+    
+    if not tunnel_url:
+        logger.warning("Tunnel process exited before reporting its URL")
+        return None, None
+    
+    try:
+        stdin, stdout, stderr = run_command(
+            ssh_client,
+            f"curl -s -m 10 -o /dev/null -w '%{{http_code}}' {tunnel_url}"
+        )
+        status_code = stdout.read().decode('utf-8').strip()
+    except socket.timeout:
+        status_code = "timeout"
+    return tunnel_url, status_code
+
 async def setup_tunnel(ssh_client, host_port: int, subdomain: str, password=None, deployment_id: str = None):
     """Set up localtunnel with deployment-specific management"""
     logger.info(f"Setting up tunnel with subdomain: {subdomain}...")
     
+    with _SETUP_SEM:
+        return await _establish_tunnel(ssh_client, host_port, subdomain, password, deployment_id)
+
+async def _establish_tunnel(ssh_client, host_port: int, subdomain: str, password, deployment_id):
+    """
+    Start the tunnel and wait for a working URL, retrying a few times.
+    Each deployment passes its own SSH client; a paramiko client is not shared between setups.
+    """
     if not deployment_id:
         deployment_id = subdomain.split('-')[-1]  # Fallback to extract from subdomain
     
-    # Create deployment-specific directory
     tunnel_dir = f"~/tunnel-{deployment_id}"
-    ssh_client.exec_command(f"mkdir -p {tunnel_dir}")
-    
-    # Verify and fix lt installation
-    lt_installed = await verify_localtunnel_installation(ssh_client, password)
-    if not lt_installed:
-        logger.error("Failed to verify localtunnel installation")
-        return None
-    
-    # Kill any existing tunnel for this specific port
-    ssh_client.exec_command(f"pkill -f 'lt --port {host_port}' || true")
-    
-    # Start tunnel with deployment-specific logging
     tunnel_log = f"{tunnel_dir}/tunnel.log"
     tunnel_pid = f"{tunnel_dir}/tunnel.pid"
-    tunnel_command = f"""
-    cd {tunnel_dir} && 
-    lt --port {host_port} --subdomain {subdomain} > {tunnel_log} 2>&1 & 
-    echo $! > {tunnel_pid}
-    """
+    sudo_prefix = f"echo '{password}' | sudo -S " if password else "sudo "
     
-    stdin, stdout, stderr = ssh_client.exec_command(tunnel_command)
-    if stdout.channel.recv_exit_status() != 0:
-        logger.error("Failed to start tunnel process")
-        return None
+    # Install localtunnel if needed and (re)start the tunnel for this port in
+    # one round-trip. The script is fed to bash on stdin, so it needs no extra
+    # quoting; the tunnel's stdin is detached so it cannot read the script.
+    start_script = (
+        f"command -v lt >/dev/null || {{ "
+        f"{{ command -v npm >/dev/null || {{ {sudo_prefix}apt-get update && {sudo_prefix}apt-get install -y nodejs npm; }}; }} "
+        f"&& {sudo_prefix}npm install -g localtunnel; }} || exit 1\n"
+        f"mkdir -p {tunnel_dir} || exit 2\n"
+        f"pkill -f 'lt --port {host_port}' || true\n"
+        f"cd {tunnel_dir} || exit 2\n"
+        f"nohup lt --port {host_port} --subdomain {subdomain} > {tunnel_log} 2>&1 < /dev/null &\n"
+        f"echo $! > {tunnel_pid}\n"
+    )
     
-    # Wait for tunnel to start and get URL
+    # Each attempt restarts the tunnel and waits for its URL
     max_retries = 3
     for attempt in range(max_retries):
-        await asyncio.sleep(5)  # Give tunnel time to start
-        
-        # Check if process is running
-        stdin, stdout, stderr = ssh_client.exec_command(f"cat {tunnel_pid} && ps -p $(cat {tunnel_pid})")
-        if stdout.channel.recv_exit_status() != 0:
-            logger.warning(f"Tunnel process not running on attempt {attempt + 1}")
-            continue
-        
-        # Check tunnel log for URL
-        stdin, stdout, stderr = ssh_client.exec_command(f"cat {tunnel_log}")
-        log_content = stdout.read().decode('utf-8')
+        if not _start_lt(ssh_client, start_script):
+            return None
         
-        url_match = re.search(r'your url is: (https://[^\s]+)', log_content)
-        if url_match:
-            tunnel_url = url_match.group(1)
+        tunnel_url, status_code = await _wait_for_url(ssh_client, tunnel_log, tunnel_pid)
+        if tunnel_url:
             logger.info(f"Tunnel URL for deployment {deployment_id}: {tunnel_url}")
             
-            # Verify tunnel is responding
-            check_cmd = f"curl -s -o /dev/null -w '%{{http_code}}' {tunnel_url}"
-            stdin, stdout, stderr = ssh_client.exec_command(check_cmd)
-            status_code = stdout.read().decode('utf-8').strip()
-            
             if status_code.startswith('2') or status_code.startswith('3'):
                 return tunnel_url
             else:
                 logger.warning(f"Tunnel URL returned status {status_code}")
-        
-        if attempt < max_retries - 1:
-            # Kill existing tunnel and retry
-            ssh_client.exec_command(f"pkill -f 'lt --port {host_port}' || true")
-            await asyncio.sleep(2)
     
     logger.error(f"Failed to establish tunnel for deployment {deployment_id} after {max_retries} attempts")
     return None
\ No newline at end of file
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import os
-import subprocess
 import sys
 
 def ensure_huggingface_cache_dir():
@@ -16,7 +15,9 @@ def run_aphrodite():
     env = os.environ.copy()
     env["APHRODITE_OPENVINO_KVCACHE_SPACE"] = os.environ.get("APHRODITE_OPENVINO_KVCACHE_SPACE", "8")
     
-    subprocess.check_call(cmd, env=env)
+    # Replace this process so aphrodite runs as PID 1 and receives docker's signals directly
+    sys.stdout.flush()
+    os.execvpe(cmd[0], cmd, env)
 
 def main():
     huggingface_token = os.environ.get("HUGGINGFACE_TOKEN")
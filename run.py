@@ -1,15 +1,27 @@
 #!/usr/bin/env python3
 import uvicorn
 import os
-from dotenv import load_dotenv
+import sys
 
 # Load environment variables from .env file
-load_dotenv()
+from app.core.config import load_env_file
+load_env_file()
 
 if __name__ == "__main__":
+    reload = os.getenv("DEBUG", "False").lower() == "true"
+    
+    # Several workers are not supported yet: each would run its own status
+    # monitor over the same documents, and deployment progress and cache
+    # invalidation are in-process, so workers would report conflicting statuses
+    if int(os.getenv("API_WORKERS", 1)) != 1:
+        sys.exit("API_WORKERS must be 1: the status monitor, deployment progress and cache are per-process")
+    
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=int(os.getenv("API_PORT", 9090)),
-        reload=os.getenv("DEBUG", "False").lower() == "true"
+        reload=reload,
+        # Deployments run as background tasks, which uvicorn waits for before the
+        # lifespan shutdown; cancel them after this long so it still runs
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", 30))
     )